@@ -1,22 +1,189 @@
 import os
+import sys
 import time
+import struct
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
+# 文本长度不同导致每次请求的显存分配大小不同，使用可扩展段减少缓存分配器碎片（需在初始化CUDA前设置）
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+# CUDA同步调试只在CUDA上下文创建时读取，必须在导入torch并加载模型前设置；
+# 通过 --debug-cuda 或环境变量 INDEXTTS_DEBUG_CUDA=1 开启，否则会串行化所有kernel启动
+if os.environ.get("INDEXTTS_DEBUG_CUDA") == "1" or (__name__ == "__main__" and "--debug-cuda" in sys.argv):
+    os.environ['CUDA_LAUNCH_BLOCKING'] = '1'
 import torch
-import torchaudio
 from fastapi import FastAPI, HTTPException, Form
 from fastapi.responses import StreamingResponse, Response
-from io import BytesIO
 import argparse
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from indextts.infer import IndexTTS
 
-# 初始化TTS模型
-tts = IndexTTS(model_dir="checkpoints", cfg_path="checkpoints/config.yaml")
+# 日志级别通过环境变量 INDEXTTS_LOG 控制，默认只输出警告及以上；
+# 在模块级别配置，多进程模式下的工作进程导入本模块时同样生效
+logging.basicConfig(level=os.getenv("INDEXTTS_LOG", "WARNING").upper())
+log = logging.getLogger("indextts.api")
+
+# 服务只做推理：关闭梯度计算
+torch.set_grad_enabled(False)
+# 音频长度几乎每次请求都不同，cudnn.benchmark会为每个新形状重新选择卷积算法，默认关闭；
+# 输入长度较固定时可通过 INDEXTTS_CUDNN_BENCHMARK=1 开启
+torch.backends.cudnn.benchmark = os.environ.get("INDEXTTS_CUDNN_BENCHMARK") == "1"
+
+# 推理精度可通过 --precision 或环境变量 INDEXTTS_PRECISION=fp16|fp32 指定（默认fp16，CPU上总是fp32）
+PRECISION = os.environ.get("INDEXTTS_PRECISION", "fp16")
+if PRECISION not in ("fp16", "fp32"):
+    raise ValueError(f"Unsupported INDEXTTS_PRECISION: {PRECISION}")
+# TTS模型在应用启动时加载，多进程模式下主进程不加载模型，只由各工作进程各自加载
+tts = None
 
 app = FastAPI()
 
 # 全局参考音频路径
 DEFAULT_REF_AUDIO = "checkpoints/default.wav"
-current_ref_audio = DEFAULT_REF_AUDIO
+# 多进程模式下子进程重新导入本模块，通过环境变量继承命令行指定的参考音频
+current_ref_audio = os.environ.get("INDEXTTS_REF_AUDIO", DEFAULT_REF_AUDIO)
+
+def compile_model(tts):
+    """使用torch.compile编译GPT自回归解码、GPT latent前向和BigVGAN的前向计算
+
+    直接替换各模块的forward，inference_speech中的generate循环也会调用编译后的前向。
+    不使用reduce-overhead模式：其CUDA graph会在后续调用中覆盖输出缓冲区，
+    而批量推理会先保存多句的latent再统一解码。dynamic=True 避免不同文本长度触发重复编译。
+
+    Returns:
+        dict: 模块到原始forward的映射，编译失败时用于恢复
+    """
+    modules = {
+        "gpt.inference_model": tts.gpt.inference_model,
+        "gpt": tts.gpt,
+        "bigvgan": tts.bigvgan,
+    }
+    original_forwards = {}
+    for name, module in modules.items():
+        original_forwards[module] = module.forward
+        module.forward = torch.compile(module.forward, dynamic=True)
+        print(f">> torch.compile enabled for {name}")
+    return original_forwards
+
+@app.on_event("startup")
+def load_model():
+    """初始化TTS模型"""
+    global tts
+    if tts is not None:
+        return
+    tts = IndexTTS(model_dir="checkpoints", cfg_path="checkpoints/config.yaml", is_fp16=PRECISION == "fp16")
+    # 通过环境变量 INDEXTTS_COMPILE=1 开启编译，并在启动时预热，避免首个请求承担编译开销
+    if os.environ.get("INDEXTTS_COMPILE") == "1":
+        original_forwards = compile_model(tts)
+        # torch.compile在首次调用时才真正编译，预热与实际请求使用相同的参考音频和执行环境
+        try:
+            _inference(tts.infer, current_ref_audio, "预热文本。", None)
+        except Exception as e:
+            print(f">> WARNING: Warm-up inference failed, torch.compile disabled: {e}")
+            for module, forward in original_forwards.items():
+                module.forward = forward
+        # 仅在预热后释放一次缓存，请求处理路径中不调用empty_cache
+        tts.torch_empty_cache()
+
+# 模型推理在专用的单线程线程池中执行：同一时刻只有一个线程使用模型，且按请求到达顺序先进先出
+infer_executor = ThreadPoolExecutor(max_workers=1)
+
+def _inference(fn, *args):
+    # 梯度开关是线程局部的，需要在执行推理的线程内开启inference_mode
+    with torch.inference_mode():
+        return fn(*args)
+
+class TTSBatcher:
+    """将短时间窗口内到达的/tts请求合并为一次批量推理
+
+    单个请求仍使用 tts.infer；批量推理失败时逐个重试，避免一个请求拖累同批的其他请求。
+
+    Args:
+        max_batch_size: 单批最多合并的请求数，不大于1时不合并
+        max_wait_ms: 收到第一个请求后等待更多请求的最长时间（毫秒）
+        max_batch_sentences: 单次GPT批量推理最多包含的句子数
+    """
+    def __init__(self, max_batch_size=1, max_wait_ms=20, max_batch_sentences=16):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_sentences = max_batch_sentences
+        self.queue = None
+        self.task = None
+
+    async def submit(self, text, ref_audio):
+        """提交请求并等待合成结果，返回 (sampling_rate, wav_data)"""
+        if self.max_batch_size <= 1:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(infer_executor, _inference, tts.infer, ref_audio, text, None)
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, ref_audio, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 参考音频不同的请求无法共享条件特征，按参考音频分组推理
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for ref_audio, items in groups.items():
+                if len(items) > 1:
+                    texts = [text for text, _, _ in items]
+                    try:
+                        results = await loop.run_in_executor(infer_executor, _inference, tts.infer_batch,
+                                                             ref_audio, texts, self.max_batch_sentences)
+                    except Exception:
+                        log.exception("Batch inference failed, retrying %d requests one by one", len(items))
+                    else:
+                        for (_, _, future), result in zip(items, results):
+                            if not future.done():
+                                future.set_result(result)
+                        continue
+                for text, _, future in items:
+                    try:
+                        result = await loop.run_in_executor(infer_executor, _inference, tts.infer, ref_audio, text, None)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+
+# 通过环境变量 INDEXTTS_BATCH_SIZE>1 开启请求合并
+batcher = TTSBatcher(max_batch_size=int(os.environ.get("INDEXTTS_BATCH_SIZE", 1)),
+                     max_wait_ms=float(os.environ.get("INDEXTTS_BATCH_WAIT_MS", 20)),
+                     max_batch_sentences=int(os.environ.get("INDEXTTS_BATCH_MAX_SENTENCES", 16)))
+
+def wav_header(sampling_rate, data_size=0xFFFFFFFF, channels=1, bits_per_sample=16):
+    """生成44字节的PCM WAV文件头，流式输出时data_size未知，使用0xFFFFFFFF"""
+    block_align = channels * bits_per_sample // 8
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', riff_size, b'WAVE',
+                       b'fmt ', 16, 1, channels, sampling_rate,
+                       sampling_rate * block_align, block_align, bits_per_sample,
+                       b'data', data_size)
+
+def wav_bytes(pcm, sampling_rate):
+    """将音频数据编码为完整的WAV文件字节，float数据视为[-1, 1]范围并转换为int16"""
+    if pcm.dtype != np.int16:
+        pcm = np.clip(pcm * 32767, -32768, 32767)
+    data = np.ascontiguousarray(pcm, dtype='<i2').tobytes()
+    return wav_header(sampling_rate, len(data)) + data
 
 @app.post("/tts")
 async def text_to_speech(text: str = Form(...)):
@@ -36,29 +203,74 @@ async def text_to_speech(text: str = Form(...)):
         if not os.path.exists(current_ref_audio):
             raise ValueError(f"Reference audio not found at {current_ref_audio}")
             
-        print(f"Processing text: {text}")  # 调试日志
-        print(f"Using reference audio: {current_ref_audio}")  # 调试日志
+        log.info("Processing text: %s", text)
+        log.info("Using reference audio: %s", current_ref_audio)
         
-        # 生成音频数据
-        sampling_rate, wav_data = tts.infer(current_ref_audio, text, None)
+        # 生成音频数据，在线程池中推理不阻塞事件循环，开启合并时并发请求会被合并为一批
+        sampling_rate, wav_data = await batcher.submit(text, current_ref_audio)
         
-        # 将音频数据转换为字节流
-        audio_stream = BytesIO()
-        torchaudio.save(audio_stream, torch.from_numpy(wav_data.T), sampling_rate, format='wav')
-        audio_stream.seek(0)
-        
-        return StreamingResponse(
-            audio_stream,
+        return Response(
+            content=wav_bytes(wav_data, sampling_rate),
             media_type="audio/wav",
             headers={
                 "Content-Disposition": "attachment; filename=output.wav"
             }
         )
     except Exception as e:
-        print(f"Error in TTS processing: {str(e)}")  # 详细错误日志
+        log.exception("Error in TTS processing")
         raise HTTPException(status_code=500, detail=f"TTS processing failed: {str(e)}")
     
 
+@app.post("/tts_stream")
+async def text_to_speech_stream(text: str = Form(...)):
+    """流式文本转语音API，逐句返回PCM数据
+
+    Args:
+        text: 要转换为语音的文本
+
+    Returns:
+        StreamingResponse: WAV文件头及逐句生成的音频数据
+    """
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    if not os.path.exists(current_ref_audio):
+        raise HTTPException(status_code=500, detail=f"TTS processing failed: Reference audio not found at {current_ref_audio}")
+
+    loop = asyncio.get_running_loop()
+    chunks = tts.infer_stream(current_ref_audio, text)
+    # 先生成第一句，出错时仍可返回错误状态码
+    try:
+        first = await loop.run_in_executor(infer_executor, _inference, next, chunks, None)
+    except Exception as e:
+        log.exception("Error in TTS processing")
+        raise HTTPException(status_code=500, detail=f"TTS processing failed: {str(e)}")
+    if first is None:
+        raise HTTPException(status_code=400, detail="No speech generated for text")
+
+    async def generate():
+        sampling_rate, wav_data = first
+        yield wav_header(sampling_rate)
+        yield wav_data.tobytes()
+        while True:
+            item = await loop.run_in_executor(infer_executor, _inference, next, chunks, None)
+            if item is None:
+                break
+            yield item[1].tobytes()
+
+    return StreamingResponse(generate(), media_type="audio/wav")
+
+
+def _multiple_workers():
+    """判断服务是否以多个工作进程运行
+
+    覆盖 run_api 设置的 INDEXTTS_WORKERS、uvicorn 使用的 WEB_CONCURRENCY，
+    以及 `uvicorn api:app --workers N`：此时工作进程由uvicorn的主进程通过multiprocessing启动。
+    """
+    for name in ("INDEXTTS_WORKERS", "WEB_CONCURRENCY"):
+        if int(os.environ.get(name, 1)) > 1:
+            return True
+    return multiprocessing.parent_process() is not None
+
 @app.post("/change_ref_audio")
 async def change_reference_audio(file_path: str):
     """更改参考音频文件
@@ -71,9 +283,19 @@ async def change_reference_audio(file_path: str):
     """
     global current_ref_audio
     
+    # 每个工作进程有各自的参考音频设置，多进程模式下只能通过 --ref-audio 在启动时指定
+    if _multiple_workers():
+        raise HTTPException(status_code=409, detail="Changing reference audio is not supported with multiple workers, use --ref-audio instead")
+
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
+    # 先计算新参考音频的条件特征，成功后再切换，后续/tts请求直接复用缓存
+    try:
+        await asyncio.get_running_loop().run_in_executor(infer_executor, _inference, tts.get_cond_mel, file_path)
+    except Exception as e:
+        log.exception("Error in loading reference audio")
+        raise HTTPException(status_code=400, detail=f"Invalid reference audio: {str(e)}")
     current_ref_audio = file_path
     return {"status": "success", "message": f"Reference audio changed to {file_path}"}
 
@@ -82,13 +304,12 @@ def run_api(host="127.0.0.1", port=8000, workers=1):
     Args:
         host: 监听主机
         port: 监听端口
-        workers: 工作进程数，默认为4
+        workers: 工作进程数，默认为1；每个进程会各自加载一份模型，且不支持/change_ref_audio
     """
     import uvicorn
-    import os
-    # 启用CUDA同步调试
-    os.environ['CUDA_LAUNCH_BLOCKING'] = '1'
-    uvicorn.run(app, host=host, port=port, workers=workers)
+    os.environ["INDEXTTS_WORKERS"] = str(workers)
+    # 多进程模式下uvicorn需要导入字符串形式的应用
+    uvicorn.run("api:app" if workers > 1 else app, host=host, port=port, workers=workers)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="IndexTTS API Server")
@@ -98,12 +319,23 @@ if __name__ == "__main__":
                        help="Host to bind (default: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=8000,
                        help="Port to listen on (default: 8000)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)),
+                       help="Number of worker processes (default: $WEB_CONCURRENCY or 1)")
+    parser.add_argument("--precision", type=str, choices=["fp16", "fp32"], default=PRECISION,
+                       help="Inference precision (default: $INDEXTTS_PRECISION or fp16)")
+    parser.add_argument("--debug-cuda", action="store_true", default=False,
+                       help="Enable synchronous CUDA kernel launches for debugging (slow), same as INDEXTTS_DEBUG_CUDA=1")
     
     args = parser.parse_args()
     
+    # 设置推理精度，模型在启动时加载，多进程模式下通过环境变量传给工作进程
+    PRECISION = args.precision
+    os.environ["INDEXTTS_PRECISION"] = PRECISION
+    
     # 设置参考音频
     if args.ref_audio and os.path.exists(args.ref_audio):
         current_ref_audio = args.ref_audio
+        os.environ["INDEXTTS_REF_AUDIO"] = current_ref_audio
     else:
         print(f"Warning: Reference audio not found at {args.ref_audio}, using default")
     
@@ -114,4 +346,4 @@ if __name__ == "__main__":
     print(f"Using reference audio: {current_ref_audio}")
     
     # 启动API服务
-    run_api(args.host, args.port)
+    run_api(args.host, args.port, args.workers)
@@ -233,49 +233,37 @@ class IndexTTS:
         except Exception as e:
             pass 
         
+    def get_cond_mel(self, audio_prompt, verbose=False):
+        """
+        Compute the reference audio mel conditioning, reusing the cached one
+        while the prompt path and its modification time are unchanged.
+        """
+        cache_key = (audio_prompt, os.path.getmtime(audio_prompt))
+        if self.cache_cond_mel is not None and self.cache_audio_prompt == cache_key:
+            return self.cache_cond_mel
+        audio, sr = torchaudio.load(audio_prompt)
+        audio = torch.mean(audio, dim=0, keepdim=True)
+        if audio.shape[0] > 1:
+            audio = audio[0].unsqueeze(0)
+        audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+        cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
+        if verbose:
+            print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
+
+        self.cache_audio_prompt = cache_key
+        self.cache_cond_mel = cond_mel
+        return cond_mel
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:self.gr_progress(value, desc=desc)
         
         
         
-    # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
-    def infer_fast(self, audio_prompt, text, output_path, verbose=False):
-        print(">> start fast inference...")
-        self._set_gr_progress(0, "start fast inference...")
-        if verbose:
-            print(f"origin text:{text}")
-        start_time = time.perf_counter()
-        normalized_text = self.preprocess_text(text)
-        print(f"normalized text:{normalized_text}")
-        
-
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-            
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
-        
-        auto_conditioning = cond_mel
-        cond_mel_lengths = torch.tensor([cond_mel_frame],device=self.device)
-        
-        # text_tokens
-        sentences = self.split_sentences(normalized_text)
-        if verbose:
-            print("sentences:", sentences)
-            
+    def _infer_fast_latents(self, auto_conditioning, sentences, timings, bucket_enable=True, verbose=False):
+        """
+        Run bucketed batch GPT inference for the sentences.
+        Returns the latents in sentence order and the number of batched sentences.
+        """
         top_p = .8
         top_k = 30
         temperature = 1.0
@@ -284,18 +272,13 @@ class IndexTTS:
         num_beams = 3
         repetition_penalty = 10.0
         max_mel_tokens = 600
-        sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
-        wavs = []
-        gpt_gen_time = 0
-        gpt_forward_time = 0
-        bigvgan_time = 0
+        cond_mel_lengths = torch.tensor([auto_conditioning.shape[-1]], device=self.device)
 
         # text processing
         all_text_tokens = []
         self._set_gr_progress(0.1, "text processing...")
-        bucket_enable = True # 预分桶开关，优先保证质量=True。优先保证速度=False。
         all_sentences = self.bucket_sentences(sentences, enable=bucket_enable) 
         for sentences in all_sentences:
             temp_tokens = []
@@ -350,7 +333,7 @@ class IndexTTS:
                                         repetition_penalty=repetition_penalty,
                                         max_generate_length=max_mel_tokens)
                     all_batch_codes.append(temp_codes)
-            gpt_gen_time += time.perf_counter() - m_start_time
+            timings["gpt_gen_time"] += time.perf_counter() - m_start_time
         
         
         # gpt latent
@@ -376,13 +359,43 @@ class IndexTTS:
                                         code_lens*self.gpt.mel_length_compression,
                                         cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
                                         return_latent=True, clip_inputs=False)
-                        gpt_forward_time += time.perf_counter() - m_start_time
+                        timings["gpt_forward_time"] += time.perf_counter() - m_start_time
                         all_latents.append(latent)
-                        
+        all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
+        return all_latents, all_batch_num
+
+    # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
+    def infer_fast(self, audio_prompt, text, output_path, verbose=False):
+        print(">> start fast inference...")
+        self._set_gr_progress(0, "start fast inference...")
+        if verbose:
+            print(f"origin text:{text}")
+        start_time = time.perf_counter()
+        normalized_text = self.preprocess_text(text)
+        print(f"normalized text:{normalized_text}")
+        
+
+        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
+        cond_mel = self.get_cond_mel(audio_prompt, verbose=verbose)
+        cond_mel_frame = cond_mel.shape[-1]
+        
+        auto_conditioning = cond_mel
+        
+        # text_tokens
+        sentences = self.split_sentences(normalized_text)
+        if verbose:
+            print("sentences:", sentences)
+            
+        sampling_rate = 24000
+        wavs = []
+        bigvgan_time = 0
+        timings = {"gpt_gen_time": 0, "gpt_forward_time": 0}
+        bucket_enable = True # 预分桶开关，优先保证质量=True。优先保证速度=False。
+        all_latents, all_batch_num = self._infer_fast_latents(auto_conditioning, sentences, timings,
+                                                              bucket_enable=bucket_enable, verbose=verbose)
         
         # bigvgan chunk
         chunk_size = 2      
-        all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
         chunk_latents = [all_latents[i:i + chunk_size] for i in range(0, len(all_latents), chunk_size)]
         chunk_length = len(chunk_latents)
         latent_length = len(all_latents)
@@ -415,8 +428,8 @@ class IndexTTS:
         wav = torch.cat(wavs, dim=1)
         wav_length = wav.shape[-1] / sampling_rate
         print(f">> Reference audio length: {cond_mel_frame*256 / sampling_rate:.2f} seconds")
-        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
-        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> gpt_gen_time: {timings['gpt_gen_time']:.2f} seconds")
+        print(f">> gpt_forward_time: {timings['gpt_forward_time']:.2f} seconds")
         print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
         print(f">> Total fast inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
@@ -432,43 +445,60 @@ class IndexTTS:
         
     
     
-    # 原始推理模式
-    def infer(self, audio_prompt, text, output_path, verbose=False):
-        print(">> start inference...")
-        self._set_gr_progress(0, "start inference...")
-        if verbose:
-            print(f"origin text:{text}")
+    # 批量推理：将多段文本的句子合并为一批进行GPT推理，再按文本分别解码
+    def infer_batch(self, audio_prompt, texts, max_batch_sentences=16, verbose=False):
+        """
+        Synthesize several texts with the same audio prompt in shared GPT batches.
+        At most ``max_batch_sentences`` sentences are sent to one GPT batch.
+        Returns a list of (sampling_rate, wav_data), one per text.
+        """
+        print(f">> start batch inference, batch size: {len(texts)}")
         start_time = time.perf_counter()
-        normalized_text = self.preprocess_text(text)
-        print(f"normalized text:{normalized_text}")
-
-
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-            
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
-        
-
-        auto_conditioning = cond_mel
-
-        sentences = self.split_sentences(normalized_text)
+        auto_conditioning = self.get_cond_mel(audio_prompt, verbose=verbose)
+        sentences = []
+        owners = []
+        for i, text in enumerate(texts):
+            for sent in self.split_sentences(self.preprocess_text(text)):
+                sentences.append(sent)
+                owners.append(i)
         if verbose:
             print("sentences:", sentences)
 
+        sampling_rate = 24000
+        timings = {"gpt_gen_time": 0, "gpt_forward_time": 0}
+        all_latents = []
+        for i in range(0, len(sentences), max_batch_sentences):
+            latents, _ = self._infer_fast_latents(auto_conditioning, sentences[i:i + max_batch_sentences],
+                                                  timings, verbose=verbose)
+            all_latents.extend(latents)
+
+        results = []
+        for i in range(len(texts)):
+            latents = [latent for latent, owner in zip(all_latents, owners) if owner == i]
+            if not latents:
+                results.append((sampling_rate, np.zeros((0, 1), dtype=np.int16)))
+                continue
+            wavs = []
+            # bigvgan chunk decode, same chunk size as infer_fast
+            for j in range(0, len(latents), 2):
+                with torch.no_grad():
+                    with torch.amp.autocast(self.device, enabled=self.dtype is not None, dtype=self.dtype):
+                        wav, _ = self.bigvgan(torch.cat(latents[j:j + 2], dim=1), auto_conditioning.transpose(1, 2))
+                        wav = wav.squeeze(1)
+                wavs.append(torch.clamp(32767 * wav, -32767.0, 32767.0))
+            wav_data = torch.cat(wavs, dim=1).cpu().type(torch.int16).numpy().T
+            results.append((sampling_rate, wav_data))
+        end_time = time.perf_counter()
+        print(f">> gpt_gen_time: {timings['gpt_gen_time']:.2f} seconds")
+        print(f">> gpt_forward_time: {timings['gpt_forward_time']:.2f} seconds")
+        print(f">> Total batch inference time: {end_time - start_time:.2f} seconds")
+        return results
+
+    def _infer_sentences(self, auto_conditioning, sentences, timings, verbose=False):
+        """
+        Synthesize sentences one by one, yielding the clamped wav tensor of each sentence.
+        Elapsed times are accumulated into ``timings``.
+        """
         top_p = .8
         top_k = 30
         temperature = 1.0
@@ -477,13 +507,8 @@ class IndexTTS:
         num_beams = 3
         repetition_penalty = 10.0
         max_mel_tokens = 600
-        sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
-        wavs = []
-        gpt_gen_time = 0
-        gpt_forward_time = 0
-        bigvgan_time = 0
 
         for sent in sentences:
             # sent = " ".join([char for char in sent.upper()]) if lang == "ZH" else sent.upper()
@@ -522,7 +547,7 @@ class IndexTTS:
                                                         num_beams=num_beams,
                                                         repetition_penalty=repetition_penalty,
                                                         max_generate_length=max_mel_tokens)
-                gpt_gen_time += time.perf_counter() - m_start_time
+                timings["gpt_gen_time"] += time.perf_counter() - m_start_time
                 #codes = codes[:, :-2]
                 code_lens = torch.tensor([codes.shape[-1]], device=codes.device, dtype=codes.dtype)
                 if verbose:
@@ -547,25 +572,69 @@ class IndexTTS:
                                     code_lens*self.gpt.mel_length_compression,
                                     cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
                                     return_latent=True, clip_inputs=False)
-                    gpt_forward_time += time.perf_counter() - m_start_time
+                    timings["gpt_forward_time"] += time.perf_counter() - m_start_time
 
                     m_start_time = time.perf_counter()
                     wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
-                    bigvgan_time += time.perf_counter() - m_start_time
+                    timings["bigvgan_time"] += time.perf_counter() - m_start_time
                     wav = wav.squeeze(1)
 
                 wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
                 print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav)
+            # wavs.append(wav[:, :-512])
+            yield wav
+
+    # 流式推理：逐句生成并返回音频数据，无需等待整段文本合成完毕
+    def infer_stream(self, audio_prompt, text, verbose=False):
+        """
+        Yields (sampling_rate, wav_data) for every sentence, wav_data is int16 with shape (samples, 1).
+        """
+        print(">> start stream inference...")
+        normalized_text = self.preprocess_text(text)
+        print(f"normalized text:{normalized_text}")
+        auto_conditioning = self.get_cond_mel(audio_prompt, verbose=verbose)
+        sentences = self.split_sentences(normalized_text)
+        if verbose:
+            print("sentences:", sentences)
+        sampling_rate = 24000
+        timings = {"gpt_gen_time": 0, "gpt_forward_time": 0, "bigvgan_time": 0}
+        for wav in self._infer_sentences(auto_conditioning, sentences, timings, verbose=verbose):
+            wav_data = wav.cpu().type(torch.int16).numpy().T
+            yield (sampling_rate, wav_data)
+
+    # 原始推理模式
+    def infer(self, audio_prompt, text, output_path, verbose=False):
+        print(">> start inference...")
+        self._set_gr_progress(0, "start inference...")
+        if verbose:
+            print(f"origin text:{text}")
+        start_time = time.perf_counter()
+        normalized_text = self.preprocess_text(text)
+        print(f"normalized text:{normalized_text}")
+
+
+        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
+        cond_mel = self.get_cond_mel(audio_prompt, verbose=verbose)
+        cond_mel_frame = cond_mel.shape[-1]
+        
+
+        auto_conditioning = cond_mel
+
+        sentences = self.split_sentences(normalized_text)
+        if verbose:
+            print("sentences:", sentences)
+
+        sampling_rate = 24000
+        timings = {"gpt_gen_time": 0, "gpt_forward_time": 0, "bigvgan_time": 0}
+        wavs = list(self._infer_sentences(auto_conditioning, sentences, timings, verbose=verbose))
         end_time = time.perf_counter()
 
         wav = torch.cat(wavs, dim=1)
         wav_length = wav.shape[-1] / sampling_rate
         print(f">> Reference audio length: {cond_mel_frame*256 / sampling_rate:.2f} seconds")
-        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
-        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
-        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> gpt_gen_time: {timings['gpt_gen_time']:.2f} seconds")
+        print(f">> gpt_forward_time: {timings['gpt_forward_time']:.2f} seconds")
+        print(f">> bigvgan_time: {timings['bigvgan_time']:.2f} seconds")
         print(f">> Total inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
         print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
@@ -1,143 +1,196 @@
-import requests
 import io
 import sounddevice as sd
-import time
 import numpy as np
 import soundfile as sf
 import re
-from queue import Queue
+import struct
+import heapq
+import itertools
+import threading
 from threading import Thread
 import argparse
+import asyncio
+import aiohttp
 
 # API配置
 DEFAULT_API_URL = "http://localhost:8000/tts"
+# 同时发送的分段请求数上限
+MAX_CONCURRENT_SEGMENTS = 4
 
-from queue import PriorityQueue
+def decode_wav(audio_data):
+    """解析WAV字节为 (samples, sample_rate)
+
+    服务端返回44字节文件头的16位PCM，直接按文件头解析；其他格式回退到soundfile。
+    """
+    if len(audio_data) >= 44:
+        (riff, _, wave, fmt, fmt_size, audio_format, channels, sample_rate,
+         _, _, bits_per_sample, data_id, _) = struct.unpack('<4sI4s4sIHHIIHH4sI', audio_data[:44])
+        if (riff, wave, fmt, data_id) == (b'RIFF', b'WAVE', b'fmt ', b'data') \
+                and fmt_size == 16 and audio_format == 1 and bits_per_sample == 16:
+            samples = np.frombuffer(audio_data, dtype='<i2', offset=44)
+            samples = samples[:len(samples) // channels * channels]
+            return samples.reshape(-1, channels), sample_rate
+    return sf.read(io.BytesIO(audio_data))
 
 class AudioPlayer:
     def __init__(self):
         self.currently_playing = False
-        self.play_queue = PriorityQueue()
+        # (segment_id, seq, generation, audio, sample_rate) 小顶堆，只有堆顶是期望的分段时才唤醒播放线程；
+        # seq为入队序号，segment_id相同时避免比较音频数组
+        self._heap = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
         self.expected_segment_id = 1
-        self.cached_segments = {}
+        # 每次reset递增，用于丢弃上一轮请求的过期分段
+        self.generation = 0
         self.worker = Thread(target=self._play_worker)
         self.worker.daemon = True
         self.worker.start()
 
     def _play_worker(self):
         while True:
-            # 获取优先级最高的音频(segment_id最小的)
-            _, (audio_data, segment_id) = self.play_queue.get()
-            
-            # 如果不是期望的segment_id，先缓存起来
-            if segment_id != self.expected_segment_id:
-                self.cached_segments[segment_id] = audio_data
-                self.play_queue.task_done()
-                continue
-                
-            # 播放当前期望的segment_id
-            self.currently_playing = True
+            with self._cv:
+                while not self._heap or self._heap[0][0] != self.expected_segment_id:
+                    self._cv.wait()
+                segment_id, _, generation, audio, sample_rate = heapq.heappop(self._heap)
+                if generation != self.generation:
+                    # 过期轮次的分段直接丢弃
+                    continue
+                self.currently_playing = True
+                # 持有锁时检查轮次并开始播放：reset()先在锁内递增轮次再调用sd.stop()，
+                # 因此已开始的播放一定会被停止，不会在新一轮开始后继续播放过期分段
+                started = self._start_play(audio, sample_rate, segment_id)
             try:
-                audio, sample_rate = sf.read(io.BytesIO(audio_data))
-                sd.play(audio, sample_rate)
-                sd.wait()
+                if started:
+                    sd.wait()
             except Exception as e:
                 print(f"音频播放错误(分段{segment_id}): {str(e)}")
             finally:
-                self.currently_playing = False
-                self.play_queue.task_done()
-                self.expected_segment_id += 1
-                
-                # 检查缓存中是否有连续的后续片段
-                while self.expected_segment_id in self.cached_segments:
-                    cached_audio = self.cached_segments.pop(self.expected_segment_id)
-                    try:
-                        audio, sample_rate = sf.read(io.BytesIO(cached_audio))
-                        sd.play(audio, sample_rate)
-                        sd.wait()
-                    except Exception as e:
-                        print(f"音频播放错误(分段{self.expected_segment_id}): {str(e)}")
-                    self.expected_segment_id += 1
-
-    def add_to_queue(self, audio_data, segment_id):
-        # 使用segment_id作为优先级，确保小的segment_id先被处理
-        self.play_queue.put((segment_id, (audio_data, segment_id)))
+                with self._cv:
+                    # 播放期间被reset时不推进新一轮的分段序号
+                    if generation == self.generation:
+                        self.currently_playing = False
+                        self.expected_segment_id += 1
+
+    def _start_play(self, audio, sample_rate, segment_id):
+        if audio is None:
+            return False
+        try:
+            sd.play(audio, sample_rate)
+            return True
+        except Exception as e:
+            print(f"音频播放错误(分段{segment_id}): {str(e)}")
+            return False
+
+    def add_to_queue(self, audio_data, segment_id, generation=None):
+        """加入播放队列，generation为reset()返回的轮次，过期轮次的分段会被丢弃
+
+        audio_data为None表示该分段请求失败，仅入队占位以便后续分段继续播放。
+        """
+        if generation is not None and generation != self.generation:
+            return
+        # 在生产者线程解码，播放线程只负责播放
+        audio, sample_rate = None, None
+        if audio_data is not None:
+            try:
+                audio, sample_rate = decode_wav(audio_data)
+            except Exception as e:
+                # 仍需入队占位，否则后续分段会一直等待该分段
+                print(f"音频解码错误(分段{segment_id}): {str(e)}")
+        # 使用segment_id作为堆的排序键，确保小的segment_id先被播放
+        with self._cv:
+            if generation is not None and generation != self.generation:
+                return
+            heapq.heappush(self._heap, (segment_id, next(self._seq), self.generation, audio, sample_rate))
+            self._cv.notify()
         
     def reset(self):
-        """重置播放状态，用于新的文本请求"""
-        # 停止当前播放
+        """重置播放状态，用于新的文本请求，返回新的播放轮次"""
+        # 先在锁内递增轮次并清空队列，复用同一个播放线程
+        with self._cv:
+            self.generation += 1
+            generation = self.generation
+            self._heap.clear()
+            self.expected_segment_id = 1
+            self.currently_playing = False
+            self._cv.notify_all()
+        # 再停止当前播放，播放线程会从sd.wait()返回
         sd.stop()
-        # 清空队列
-        while not self.play_queue.empty():
-            try:
-                self.play_queue.get_nowait()
-                self.play_queue.task_done()
-            except:
-                break
-        # 重置状态
-        self.expected_segment_id = 1
-        self.cached_segments.clear()
-        self.currently_playing = False
-        # 重新初始化工作线程
-        if self.worker.is_alive():
-            self.worker.join(timeout=0.1)
-        self.worker = Thread(target=self._play_worker)
-        self.worker.daemon = True
-        self.worker.start()
+        return generation
 
 player = AudioPlayer()
 
+# 文本结尾标点
+_END_PUNCT_RE = re.compile(r'[。！？；，\.\!\?;]$')
+# 一个句子：文本加上结尾的连续标点；或到行尾为止没有标点的文本
+_SENT_RE = re.compile(r'[^\n。！？；，.!?;]*[。！？；，.!?;]+|[^\n。！？；，.!?;]+')
+
 def split_text(text):
     """按标点符号分割文本，短句子(少于20字符)合并到下一句"""
-    # 如果文本不以标点符号结尾，添加句号
-    if text and not re.search(r'[。！？；，\.\!\?;]$', text):
-        text += '。'
-        
-    # 定义所有需要分割的标点符号（中文和英文）
-    punctuation_pattern = r'([。！？；，\.\!\?;])'
-    
-    # 先按段落分割
-    paragraphs = text.split('\n')
     segments = []
-    buffer = ""
+    buffer = []
+    length = 0
     
-    for para in paragraphs:
-        if not para.strip():
+    # 单次扫描逐句匹配（句子内容+结尾标点），换行作为句子结束
+    for m in _SENT_RE.finditer(text):
+        segment = m.group()
+        if not segment.strip():  # 忽略空段
             continue
-            
-        # 按标点分割段落
-        parts = re.split(punctuation_pattern, para)
-        
-        # 合并标点符号到前一段
-        for i in range(0, len(parts)-1, 2):
-            segment = parts[i] + (parts[i+1] if i+1 < len(parts) else "")
-            if not segment.strip():  # 忽略空段
-                continue
-                
-            # 添加到缓冲区
-            buffer += segment
-            
-            # 检查长度或段落结束
-            if len(buffer) >= 20 or i+2 >= len(parts):
-                segments.append(buffer)
-                buffer = ""
+        # 行尾或文本末尾没有标点的句子补上句号，避免与下一行直接连在一起
+        if not _END_PUNCT_RE.search(segment):
+            segment += '。'
+        buffer.append(segment)
+        length += len(segment)
+        if length >= 20:
+            segments.append(''.join(buffer))
+            buffer = []
+            length = 0
     
     # 添加剩余内容
     if buffer:
-        segments.append(buffer)
+        segments.append(''.join(buffer))
     
     return segments
 
-from concurrent.futures import ThreadPoolExecutor
+# 持久化的事件循环和HTTP会话，在多次请求间复用TCP连接
+_loop = asyncio.new_event_loop()
+_session = None
 
-def test_tts(text, api_url):
-    """测试TTS API"""
+async def get_session():
+    """获取共享的aiohttp会话，首次调用时创建"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession()
+    return _session
+
+async def send_segment(session, api_url, segment, i, total, generation=None):
+    """发送单个分段并将结果加入播放队列，失败时加入占位以免阻塞后续分段"""
+    audio_data = None
+    try:
+        print(f"发送分段 {i}/{total}: {segment[:30]}...")
+        async with session.post(
+            api_url,
+            data={"text": segment},
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        ) as response:
+            if response.status == 200:
+                print(f"分段 {i} TTS成功，加入播放队列")
+                audio_data = await response.read()
+            else:
+                print(f"分段 {i} TTS失败，状态码: {response.status}")
+                print(await response.text())
+    except Exception as e:
+        print(f"分段 {i} 请求异常: {str(e)}")
+    player.add_to_queue(audio_data, i, generation)
+
+async def test_tts_async(text, api_url):
+    """测试TTS API，所有分段通过共享会话并发发送"""
     try:
         # 确保之前的播放完成
         while player.currently_playing:
-            time.sleep(0.1)
+            await asyncio.sleep(0.1)
         # 重置播放器状态
-        player.reset()
+        generation = player.reset()
         segments = split_text(text)
         if not segments:
             print("无法分割文本")
@@ -145,58 +198,23 @@ def test_tts(text, api_url):
             
         print(f"文本已分割为{len(segments)}段")
         
-        # 优先处理前2个分段
-        for i in range(1, min(3, len(segments)+1)):
-            segment = segments[i-1]
-            try:
-                print(f"优先发送分段 {i}/{len(segments)}: {segment[:30]}...")
-                response = requests.post(
-                    api_url,
-                    data={"text": segment},
-                    headers={"Content-Type": "application/x-www-form-urlencoded"}
-                )
-                if response and response.status_code == 200:
-                    print(f"分段 {i} TTS成功，加入播放队列")
-                    player.add_to_queue(response.content, i)
-                elif response:
-                    print(f"分段 {i} TTS失败，状态码: {response.status_code}")
-                    print(response.text)
-            except Exception as e:
-                print(f"分段 {i} 请求异常: {str(e)}")
-        
-        # 按顺序异步发送剩余分段
-        if len(segments) > 2:
-            import aiohttp
-            import asyncio
-            
-            async def send_segments():
-                async with aiohttp.ClientSession() as session:
-                    for i in range(3, len(segments)+1):
-                        segment = segments[i-1]
-                        try:
-                            print(f"发送分段 {i}/{len(segments)}: {segment[:30]}...")
-                            async with session.post(
-                                api_url,
-                                data={"text": segment},
-                                headers={"Content-Type": "application/x-www-form-urlencoded"}
-                            ) as response:
-                                if response.status == 200:
-                                    print(f"分段 {i} TTS成功，加入播放队列")
-                                    player.add_to_queue(await response.read(), i)
-                                else:
-                                    print(f"分段 {i} TTS失败，状态码: {response.status}")
-                                    print(await response.text())
-                        except Exception as e:
-                            print(f"分段 {i} 请求异常: {str(e)}")
-            
-            # 在事件循环中运行异步任务
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(send_segments())
+        # 按顺序启动请求，前面的分段先获得并发名额，播放器会按分段顺序播放
+        session = await get_session()
+        sem = asyncio.Semaphore(MAX_CONCURRENT_SEGMENTS)
+
+        async def send_one(i):
+            async with sem:
+                await send_segment(session, api_url, segments[i-1], i, len(segments), generation)
+
+        await asyncio.gather(*(send_one(i) for i in range(1, len(segments)+1)))
                     
     except Exception as e:
         print(f"发生错误: {str(e)}")
 
+def test_tts(text, api_url):
+    """测试TTS API"""
+    _loop.run_until_complete(test_tts_async(text, api_url))
+
 if __name__ == "__main__":
     import pyperclip
     import tkinter as tk
@@ -239,3 +257,7 @@ if __name__ == "__main__":
             test_tts(text, API_URL)
         else:
             print("输入不能为空")
+
+    # 关闭共享的HTTP会话
+    if _session is not None:
+        _loop.run_until_complete(_session.close())
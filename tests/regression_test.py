@@ -26,3 +26,19 @@ if __name__ == "__main__":
     '''.replace("\n", "")
     tts.infer_fast(audio_prompt=prompt_wav, text=text, output_path=f"outputs/{text[:20]}.wav", verbose=True)
 
+    # 流式推理测试：每句返回一段音频
+    text="大家好，我现在正在bilibili 体验 ai 科技。说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！"
+    sentences = tts.split_sentences(tts.preprocess_text(text))
+    chunks = list(tts.infer_stream(audio_prompt=prompt_wav, text=text, verbose=True))
+    assert len(chunks) == len(sentences), f"expected {len(sentences)} chunks, got {len(chunks)}"
+    for sampling_rate, wav_data in chunks:
+        assert sampling_rate == 24000 and wav_data.ndim == 2 and wav_data.shape[0] > 0
+
+    # 批量推理测试：每段文本按顺序返回一段音频
+    texts = ["晕 XUAN4 是 一 种 GAN3 觉", "There is a vehicle arriving in dock number 7? The weather is really nice today."]
+    results = tts.infer_batch(audio_prompt=prompt_wav, texts=texts, verbose=True)
+    assert len(results) == len(texts), f"expected {len(texts)} results, got {len(results)}"
+    for sampling_rate, wav_data in results:
+        assert sampling_rate == 24000 and wav_data.ndim == 2 and wav_data.shape[0] > 0
+    # 第二段文本更长，生成的音频也应更长，用于确认结果顺序
+    assert results[1][1].shape[0] > results[0][1].shape[0]